@@ -3,19 +3,23 @@ import pandas as pd
 import altair as alt
 import requests
 import datetime
-import re
+import contextlib
+import hashlib
 from sidebar import render_sidebar, ROLE_COLORS
 from render_text import reformat_text_html_with_tooltips, predict_entity_framing, format_sentence_with_spans
 from streamlit.components.v1 import html as st_html
 import streamlit as st
 import sys
 import os
+import shutil
 from pathlib import Path
-import ast
+import json
 from mode_tc_utils.preprocessing import convert_prediction_txt_to_csv
 from mode_tc_utils.tc_inference import run_role_inference
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import secrets
+import torch
+from utils.model_cache import add_non_o_bias, has_quantized_export, ner_model_path, quantized_dir, QUANTIZED_FILE, NER_MODEL_PATH, CLS_MODEL_PATH
 
 # Add the seq directory to the path to import predict.py
 sys.path.append(str(Path(__file__).parent / 'seq'))
@@ -24,25 +28,106 @@ sys.path.append(str(Path(__file__).parent / 'seq'))
 # MODEL CACHING - Load both models once on app launch
 # ============================================================================
 
+# Nothing in this app trains; keep autograd off (grad mode is per thread, so this runs on every rerun)
+torch.set_grad_enabled(False)
+
+
+@contextlib.contextmanager
+def _infer():
+    """Context for every model call: no autograd bookkeeping at all."""
+    with torch.inference_mode():
+        yield
+
+
+# Per-span probability keys and the main role each one stands for (same order)
+ROLE_PROB_KEYS = ('prob_antagonist', 'prob_protagonist', 'prob_innocent', 'prob_unknown')
+ROLE_NAMES = ('Antagonist', 'Protagonist', 'Innocent', 'Unknown')
+
+# Warm-up inputs run once at load time so the first user click doesn't pay the compile cost
+NER_WARMUP_TEXT = "The minister met the delegation in Kyiv."
+STAGE2_WARMUP_TEXTS = [
+    "Entity: Kyiv\nMain Role: Innocent\nContext: The minister met the delegation in Kyiv.",
+    "Entity: The minister\nMain Role: Protagonist\nContext: The minister met the delegation in Kyiv "
+    "and promised further support to the families affected by the shelling.",
+]
+
+
+def compile_for_inference(model, warmup, dynamic=None):
+    """Apply BetterTransformer (where the architecture supports it) and torch.compile, then run `warmup(module)`.
+
+    torch.compile is lazy, so compile errors only surface on the first forward pass. If the warm-up
+    fails on the compiled module, the eager module is warmed up and returned instead.
+    CUDA graphs ('reduce-overhead') are not used: their state is per thread, and Streamlit runs
+    every rerun on a new thread, so graphs recorded during the warm-up would never be reused.
+    """
+    try:
+        from optimum.bettertransformer import BetterTransformer
+        model = BetterTransformer.transform(model, keep_original_model=False)
+    except Exception as e:
+        print(f"BetterTransformer not applied: {e}")
+    try:
+        compiled = torch.compile(model, mode='default', dynamic=dynamic, fullgraph=False)
+        warmup(compiled)
+        return compiled
+    except Exception as e:
+        print(f"torch.compile not applied, using eager model: {e}")
+        torch._dynamo.reset()
+    warmup(model)
+    return model
+
+
 @st.cache_resource
 def load_ner_model():
     """Load the NER model once and cache it."""
     try:
-        import torch
         from src.deberta import DebertaV3NerClassifier
         
-        model_path = 'artur-muratov/franx-ner'
-        bert_model = DebertaV3NerClassifier.load(model_path)
+        model_path = ner_model_path()
+        try:
+            bert_model = DebertaV3NerClassifier.load(model_path)
+        except Exception as e:
+            if model_path == NER_MODEL_PATH:
+                raise
+            # FRANX_FAST=1 but the student is not available; serve the full model instead
+            st.warning(f"Could not load the fast NER model {model_path} ({e}); using {NER_MODEL_PATH} instead.")
+            model_path = NER_MODEL_PATH
+            bert_model = DebertaV3NerClassifier.load(model_path)
         
         # Add +1 bias to non-O classes (same as inference_deberta)
-        with torch.no_grad():
-            current_bias = bert_model.model.classifier.bias
-            o_index = bert_model.label2id.get('O', 0)
-            for i in range(len(current_bias)):
-                if i != o_index:
-                    current_bias[i] += 1.0
+        add_non_o_bias(bert_model)
         
-        bert_model.model = bert_model.model.to('cuda' if torch.cuda.is_available() else 'cpu')
+        if torch.cuda.is_available():
+            # Half-precision backbone (bias tweak above was done in FP32). The CRF is detached
+            # before the cast so its transition weights are never rounded and stay FP32.
+            half_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            crf = bert_model.model.crf
+            bert_model.model.crf = None
+            bert_model.model = bert_model.model.to('cuda').to(half_dtype)
+            bert_model.model.crf = crf.to('cuda')
+
+            def warmup(module):
+                bert_model.model = module
+                with _infer():
+                    bert_model.predict(NER_WARMUP_TEXT, return_format='spans')
+
+            # Windows are padded to max_length with batch 1, so shapes are static
+            bert_model.model = compile_for_inference(bert_model.model, warmup)
+        elif has_quantized_export(model_path):
+            # ONNX Runtime INT8 backbone from export_and_quantize.py; the CRF head stays in PyTorch
+            from optimum.onnxruntime import ORTModelForTokenClassification
+            ort_model = ORTModelForTokenClassification.from_pretrained(
+                quantized_dir(model_path), file_name=QUANTIZED_FILE
+            )
+            ort_model.crf = bert_model.model.crf
+            bert_model.model = ort_model
+        else:
+            # Dynamic INT8 quantization of the Linear layers (after the bias tweak above)
+            torch.set_num_threads(os.cpu_count() or 1)
+            if 'onednn' in torch.backends.quantized.supported_engines:
+                torch.backends.quantized.engine = 'onednn'
+            bert_model.model = torch.ao.quantization.quantize_dynamic(
+                bert_model.model.to('cpu'), {torch.nn.Linear}, dtype=torch.qint8
+            )
         if hasattr(bert_model, 'merger'):
             bert_model.merger.threshold = 0.5
             
@@ -59,10 +144,33 @@ def load_stage2_model():
     try:
         from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
         
-        model_path = "artur-muratov/franx-cls"
-        tokenizer = AutoTokenizer.from_pretrained(model_path)
-        model = AutoModelForSequenceClassification.from_pretrained(model_path)
-        clf_pipeline = pipeline("text-classification", model=model, tokenizer=tokenizer, return_all_scores=True)
+        model_path = CLS_MODEL_PATH
+        device = -1
+        if torch.cuda.is_available():
+            half_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+            tokenizer = AutoTokenizer.from_pretrained(model_path)
+            model = AutoModelForSequenceClassification.from_pretrained(model_path).to(half_dtype).to('cuda')
+            device = 0
+        elif has_quantized_export(model_path):
+            # ONNX Runtime INT8 model from export_and_quantize.py
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+            tokenizer = AutoTokenizer.from_pretrained(quantized_dir(model_path))
+            model = ORTModelForSequenceClassification.from_pretrained(
+                quantized_dir(model_path), file_name=QUANTIZED_FILE
+            )
+        else:
+            tokenizer = AutoTokenizer.from_pretrained(model_path)
+            model = AutoModelForSequenceClassification.from_pretrained(model_path)
+        clf_pipeline = pipeline("text-classification", model=model, tokenizer=tokenizer, device=device, return_all_scores=True)
+
+        if device == 0:
+            def warmup(module):
+                clf_pipeline.model = module
+                with _infer():
+                    clf_pipeline(STAGE2_WARMUP_TEXTS, batch_size=len(STAGE2_WARMUP_TEXTS), truncation=True, top_k=None)
+
+            # Batches are padded to their longest text, so compile with dynamic shapes
+            clf_pipeline.model = compile_for_inference(clf_pipeline.model, warmup, dynamic=True)
         
         return clf_pipeline
     except Exception as e:
@@ -71,6 +179,27 @@ def load_stage2_model():
 
 
 
+def article_digest(text):
+    """Short content hash used as the cache key for per-article inference."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# Inference caches are keyed on a hash of their input only; underscore arguments are not hashed by Streamlit
+@st.cache_data(show_spinner=False, max_entries=32)
+def predict_spans_cached(article_hash, _bert_model, _text):
+    """Run NER on the article text, cached so repeated clicks on the same text skip inference."""
+    with _infer():
+        return _bert_model.predict(_text, return_format='spans')
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def classify_texts_cached(texts_hash, _clf_pipeline, _texts):
+    """Run Stage 2 on all entity texts of an article in one batched call, cached per set of texts."""
+    with _infer():
+        return _clf_pipeline(_texts, batch_size=16, truncation=True, top_k=None)
+
+
+
 def predict_with_cached_model(article_id, bert_model, text, output_filename="predictions.txt", output_dir="output"):
     """Run prediction using the cached NER model."""
     from pathlib import Path
@@ -80,7 +209,7 @@ def predict_with_cached_model(article_id, bert_model, text, output_filename="pre
     output_path.mkdir(exist_ok=True)
     
     # Get predictions from the model
-    spans = bert_model.predict(text, return_format='spans')
+    spans = predict_spans_cached(article_digest(text), bert_model, text)
     pred_spans = []
     
     for sp in spans:
@@ -88,11 +217,8 @@ def predict_with_cached_model(article_id, bert_model, text, output_filename="pre
         seg = text[s:e]
         s += len(seg) - len(seg.lstrip())
         e -= len(seg) - len(seg.rstrip())
-        role_probs = [(sp['prob_antagonist'], 'Antagonist'),
-                      (sp['prob_protagonist'], 'Protagonist'),
-                      (sp['prob_innocent'], 'Innocent'),
-                      (sp['prob_unknown'], 'Unknown')]
-        _, role = max(role_probs)
+        probs = [sp[k] for k in ROLE_PROB_KEYS]
+        role = ROLE_NAMES[probs.index(max(probs))]
         pred_spans.append((s, e, role))
 
     # Format predictions for output
@@ -106,57 +232,81 @@ def predict_with_cached_model(article_id, bert_model, text, output_filename="pre
         # Format: entity_text, start, end, role
         output_lines.append(f"{article_id}\t{entity_text}\t{s}\t{e}\t{role}")
 
-    # Save predictions to txt file
+    # Save predictions to txt file (serialized once)
+    payload = '\n'.join(output_lines)
     output_file_path = output_path / (article_id + "_predictions.txt")
-    output_file_path.write_text('\n'.join(output_lines), encoding='utf-8')
+    output_file_path.write_text(payload, encoding='utf-8')
 
+    # Mirror to current_article_preds.txt by copying the file rather than serializing again.
+    # A copy (not a hard link) keeps later writes to either file independent.
     a = Path("article_predictions") / "current_article_preds.txt"
-    a.write_text('\n'.join(output_lines), encoding='utf-8')
+    shutil.copyfile(output_file_path, a)
     
-    return output_lines, non_unknown
+    return output_lines, non_unknown, spans
 
 
 
-def run_stage2_with_cached_model(article_id, clf_pipeline, df, threshold=0.01, margin=0.05):
-    """Run stage 2 inference using the cached classification model."""
+def run_stage2_with_cached_model(article_id, clf_pipeline, df, threshold=0.01, margin=0.05, skip_unknown=True):
+    """Run stage 2 inference using the cached classification model.
 
-    def pipeline_with_confidence(example, threshold=threshold):
-        input_text = (
-            f"Entity: {example['entity_mention']}\n"
-            f"Main Role: {example['p_main_role']}\n"
-            f"Context: {example['context']}"
-        )
-        try:
-            scores = clf_pipeline(input_text)[0]  # [{'label': ..., 'score': ...}]
-        except Exception as e:
-            print(f"Error in pipeline: {e}")
-            return {}
+    Scores are cached on a hash of the exact texts sent to the classifier.
+    With `skip_unknown`, entities Stage 1 labelled Unknown are not classified and get empty fine roles.
+    """
 
+    def scores_above_threshold(scores, threshold=threshold):
         filtered_scores = {
             s['label']: round(s['score'], 4) for s in scores if s['score'] > threshold
         }
         return dict(sorted(filtered_scores.items(), key=lambda x: x[1], reverse=True))
 
-    def select_roles_within_margin(scores, margin=margin):
-        if not scores:
-            return []
-        top_score = max(scores.values())
-        return [role for role, score in scores.items() if score >= top_score - margin]
-
-    def filter_scores_by_margin(row):
-        scores = row['predicted_fine_with_scores']
-        margin_roles = row['predicted_fine_margin']
-        return {role: scores[role] for role in margin_roles if role in scores}
+    # Classify all (non-Unknown) entities in one batched pipeline call
+    classify_mask = [not (skip_unknown and role == 'Unknown') for role in df['p_main_role']]
+    texts = [
+        f"Entity: {r.entity_mention}\nMain Role: {r.p_main_role}\nContext: {r.context}"
+        for r, keep in zip(df.itertuples(), classify_mask) if keep
+    ]
+    try:
+        all_scores = classify_texts_cached(article_digest('\0'.join(texts)), clf_pipeline, texts) if texts else []
+    except Exception as e:
+        print(f"Error in pipeline: {e}")
+        all_scores = [[] for _ in texts]
+
+    # Threshold, then keep roles within `margin` of the top score (dicts are sorted, so the first is the top)
+    scores_iter = iter(all_scores)
+    scores_list = [scores_above_threshold(next(scores_iter)) if keep else {} for keep in classify_mask]
+    margins = [
+        [role for role, score in d.items() if score >= next(iter(d.values())) - margin]
+        for d in scores_list
+    ]
+    filtered = [{role: d[role] for role in m} for d, m in zip(scores_list, margins)]
 
     # Apply predictions
-    df['predicted_fine_with_scores'] = df.apply(pipeline_with_confidence, axis=1)
-    df['predicted_fine_margin'] = df['predicted_fine_with_scores'].apply(select_roles_within_margin)
-    df['p_fine_roles_w_conf'] = df.apply(filter_scores_by_margin, axis=1)
+    df['predicted_fine_with_scores'] = scores_list
+    df['predicted_fine_margin'] = margins
+    df['p_fine_roles_w_conf'] = filtered
     df['article_id'] = article_id
 
     return df
 
 
+# Stage 2 columns holding lists/dicts; persisted as JSON rather than Python reprs
+STAGE2_JSON_COLUMNS = ['predicted_fine_with_scores', 'predicted_fine_margin', 'p_fine_roles_w_conf']
+
+def stage2_df_for_csv(df):
+    """Return a copy of the Stage 2 output with the list/dict columns JSON-encoded."""
+    return df.assign(**{col: df[col].map(json.dumps) for col in STAGE2_JSON_COLUMNS if col in df})
+
+
+def append_stage2_csv(df, csv_path):
+    """Append Stage 2 rows to `csv_path`, writing the header only when the file is new."""
+    out = stage2_df_for_csv(df)
+    header = not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+    if not header:
+        # Match the existing column order (only the header row is read)
+        out = out.reindex(columns=pd.read_csv(csv_path, nrows=0).columns)
+    out.to_csv(csv_path, mode='a', header=header, index=False, encoding='utf-8')
+
+
 # Load models on app startup
 NER_MODEL = load_ner_model()
 STAGE2_MODEL = load_stage2_model()
@@ -179,9 +329,6 @@ else:
     #model = ChatOpenAI(temperature=0.7, api_key=openai_api_key)
     #st.info(model.invoke(input_text))
 
-def escape_entity(entity):
-    return re.sub(r'([.^$*+?{}\[\]\\|()])', r'\\\1', entity)
-
 def filter_labels_by_role(labels, role_filter):
     filtered = {}
     for entity, mentions in labels.items():
@@ -286,9 +433,11 @@ if PREDICTION_AVAILABLE:
                 st.stop()
             try:
                 with st.spinner("Fetching article from URL..."):
-                    resp = requests.get(url)
-                    soup = BeautifulSoup(resp.content, 'html.parser')
-                    article = '\n'.join(p.get_text() for p in soup.find_all('p'))
+                    # Stream the body straight into lxml, keeping only <p> tags
+                    with requests.get(url, stream=True, timeout=10) as resp:
+                        resp.raw.decode_content = True
+                        soup = BeautifulSoup(resp.raw, 'lxml', parse_only=SoupStrainer('p'))
+                    article = '\n'.join(p.get_text().strip() for p in soup.find_all('p'))
                 if not article.strip():
                     st.warning("Could not extract meaningful content from the URL. Please check a different URL or paste the text directly.")
                     st.stop()
@@ -326,7 +475,7 @@ if PREDICTION_AVAILABLE:
                         
                     # Run prediction with cached NER model
                     #puts values in the current_articles_predictions.txt file
-                    predictions, non_unknown_count = predict_with_cached_model(
+                    predictions, non_unknown_count, entity_spans = predict_with_cached_model(
                         article_id=filename_wo_pred,
                         bert_model=NER_MODEL,
                         text=article,
@@ -339,17 +488,12 @@ if PREDICTION_AVAILABLE:
                     # convert txt output of stage 1 into csv and prepare for text classification model 2
                     # also extracts context
                     #puts things into tc_input
-                    # Step 1: Load existing tc_output.csv (if it exists)
+                    # Step 1: Stage 2 input/output paths
                     input_stage2_csv_path = os.path.join(predictions_dir, "tc_input.csv")
                     output_stage2_csv_path = os.path.join(predictions_dir, "tc_output.csv")
 
-                    if os.path.exists(output_stage2_csv_path):
-                        existing_df = pd.read_csv(output_stage2_csv_path)
-                    else:
-                        existing_df = pd.DataFrame()
-
-                    # Step 2: Convert Stage 1 predictions into CSV
-                    convert_prediction_txt_to_csv(
+                    # Step 2: Convert Stage 1 predictions into CSV (also returned as a DataFrame)
+                    new_input_df = convert_prediction_txt_to_csv(
                         article_id=filename_wo_pred,
                         article=article,
                         prediction_file=os.path.join(predictions_dir, "current_article_preds.txt"),
@@ -357,20 +501,15 @@ if PREDICTION_AVAILABLE:
                         output_csv=input_stage2_csv_path
                     )
 
-                    # Step 3: Load newly written tc_input.csv
-                    new_input_df = pd.read_csv(input_stage2_csv_path)
-
-                    # Step 4: Run Stage 2 predictions on new inputs
-                    new_stage2_df = run_stage2_with_cached_model(filename_wo_pred, STAGE2_MODEL, new_input_df)
-
-                    # Step 5: Merge existing + new predictions
-                    combined_df = pd.concat([existing_df, new_stage2_df], ignore_index=True)
+                    # Step 3: Run Stage 2 predictions on new inputs
+                    new_stage2_df = run_stage2_with_cached_model(
+                        filename_wo_pred, STAGE2_MODEL, new_input_df
+                    )
 
-                    # Step 6: Save to tc_output.csv
-                    output_path = os.path.join(predictions_dir, "tc_output.csv")
-                    combined_df.to_csv(output_path, index=False, encoding="utf-8")
+                    # Step 4: Append new predictions to tc_output.csv (no full reload/rewrite)
+                    append_stage2_csv(new_stage2_df, output_stage2_csv_path)
 
-                    #st.success(f"✅ tc_output.csv updated with {len(new_stage2_df)} new rows ({len(combined_df)} total)")
+                    #st.success(f"✅ tc_output.csv updated with {len(new_stage2_df)} new rows")
                     
                     st.success(f"✅ Entity analysis complete! Found {len(predictions)} entities ({non_unknown_count} with specific roles)")
                     
@@ -379,25 +518,24 @@ if PREDICTION_AVAILABLE:
                         a = user_dir / filename_wo_pred
                         a.write_text(article, encoding='utf-8')
                         with st.expander("🎯 Detected Entities", expanded=True):
-                            # Get all entity spans with confidence scores ONCE (not in the loop!)
-                            entity_spans = NER_MODEL.predict(article, return_format='spans')
+                            # Reuse the spans from the prediction run instead of re-running NER
+                            span_by_range = {(sp['start'], sp['end']): sp for sp in entity_spans}
                                 
                             for i, pred in enumerate(predictions):
                                 text_id, entity, start, end, role = pred.split('\t')
                                     
                                 # Find matching span for this entity
                                 confidence_score = None
-                                for span in entity_spans:
-                                    if span['start'] == int(start) and span['end'] == int(end):
-                                        if role == "Protagonist":
-                                            confidence_score = span['prob_protagonist']
-                                        elif role == "Antagonist":
-                                            confidence_score = span['prob_antagonist']
-                                        elif role == "Innocent":
-                                            confidence_score = span['prob_innocent']
-                                        elif role == "Unknown":
-                                            confidence_score = span['prob_unknown']
-                                        break
+                                span = span_by_range.get((int(start), int(end)))
+                                if span is not None:
+                                    if role == "Protagonist":
+                                        confidence_score = span['prob_protagonist']
+                                    elif role == "Antagonist":
+                                        confidence_score = span['prob_antagonist']
+                                    elif role == "Innocent":
+                                        confidence_score = span['prob_innocent']
+                                    elif role == "Unknown":
+                                        confidence_score = span['prob_unknown']
                                     
                                 confidence_text = f" (confidence: {confidence_score:.3f})" if confidence_score is not None else ""
                                     
@@ -420,22 +558,10 @@ if PREDICTION_AVAILABLE:
                                 entity = row.get("entity_mention", "N/A")
                                 main_role = row.get("p_main_role", "N/A")
 
-                                # Parse list of fine roles and their scores
+                                # List of fine roles and their scores (in-memory Python objects)
                                 fine_roles = row.get("predicted_fine_margin", [])
                                 fine_scores = row.get("predicted_fine_with_scores", {})
 
-                                if isinstance(fine_roles, str):
-                                    try:
-                                        fine_roles = ast.literal_eval(fine_roles)
-                                    except:
-                                        fine_roles = []
-
-                                if isinstance(fine_scores, str):
-                                    try:
-                                        fine_scores = ast.literal_eval(fine_scores)
-                                    except:
-                                        fine_scores = {}
-
                                 # Format role + score for display
                                 formatted_roles = ", ".join(
                                 f"{role}: confidence = {fine_scores.get(role, '—')}" for role in fine_roles
@@ -472,7 +598,7 @@ if PREDICTION_AVAILABLE:
     #                    os.makedirs(predictions_dir, exist_ok=True)
     #                    
     #                    # Run prediction with cached model and save
-    #                    predictions, non_unknown_count = predict_with_cached_model(
+    #                    predictions, non_unknown_count, entity_spans = predict_with_cached_model(
     #                        article_id=filename,
     #                        bert_model=NER_MODEL,
     #                        text=article,
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Export the NER and Stage 2 models to ONNX and apply dynamic INT8 quantization.
+
+The quantized graphs are cached under ~/.cache/franx/ and picked up by the
+model loaders in Home.py when running on CPU.
+
+Usage:
+    python export_and_quantize.py
+    FRANX_FAST=1 python export_and_quantize.py   # export the distilled NER student instead
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+# Add project root to path
+sys.path.append(str(Path(__file__).parent))
+
+from utils.model_cache import (
+    CLS_MODEL_PATH, QUANTIZED_FILE, add_non_o_bias, ner_model_path, quantized_dir,
+)
+
+# Only MatMul/Add are quantized; nodes matching these patterns stay in FP32
+NODES_TO_EXCLUDE = ['LayerNorm', 'Gelu', 'Softmax', 'Gather']
+
+
+def _excluded_node_names(onnx_path):
+    import onnx
+
+    patterns = [p.lower() for p in NODES_TO_EXCLUDE]
+    graph = onnx.load(str(onnx_path)).graph
+    return [
+        node.name for node in graph.node
+        if any(p in node.name.lower() or p == node.op_type.lower() for p in patterns)
+    ]
+
+
+def _quantize(ort_model, save_dir):
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    save_dir.mkdir(parents=True, exist_ok=True)
+    ort_model.save_pretrained(save_dir)
+
+    quantizer = ORTQuantizer.from_pretrained(ort_model)
+    qconfig = AutoQuantizationConfig.avx512_vnni(
+        is_static=False,
+        per_channel=False,
+        operators_to_quantize=['MatMul', 'Add'],
+        nodes_to_exclude=_excluded_node_names(save_dir / "model.onnx"),
+    )
+    quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+
+
+def export_ner_model(model_path=None):
+    """Export the NER backbone (with the non-O bias already applied) and quantize it."""
+    from optimum.onnxruntime import ORTModelForTokenClassification
+    from src.deberta import DebertaV3NerClassifier
+
+    model_path = model_path or ner_model_path()
+    save_dir = quantized_dir(model_path)
+    print(f"Exporting NER model {model_path} -> {save_dir}")
+
+    bert_model = DebertaV3NerClassifier.load(model_path)
+    add_non_o_bias(bert_model)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The CRF head runs in PyTorch; only export the transformer backbone
+        bert_model.model.crf = None
+        bert_model.model.to('cpu').save_pretrained(tmp)
+        bert_model.tokenizer.save_pretrained(tmp)
+        ort_model = ORTModelForTokenClassification.from_pretrained(tmp, export=True)
+        _quantize(ort_model, save_dir)
+
+    bert_model.tokenizer.save_pretrained(save_dir)
+    print(f"✅ NER model quantized: {save_dir / QUANTIZED_FILE}")
+
+
+def export_stage2_model(model_path=CLS_MODEL_PATH):
+    """Export the Stage 2 classification model and quantize it."""
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+    from transformers import AutoTokenizer
+
+    save_dir = quantized_dir(model_path)
+    print(f"Exporting Stage 2 model {model_path} -> {save_dir}")
+
+    ort_model = ORTModelForSequenceClassification.from_pretrained(model_path, export=True)
+    _quantize(ort_model, save_dir)
+
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(save_dir)
+    print(f"✅ Stage 2 model quantized: {save_dir / QUANTIZED_FILE}")
+
+
+def main():
+    export_ner_model()
+    export_stage2_model()
+
+
+if __name__ == "__main__":
+    main()
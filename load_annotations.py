@@ -1,4 +1,5 @@
 import csv
+import json
 from collections import defaultdict
 from pathlib import Path
 import streamlit as st
@@ -86,11 +87,15 @@ def safe_margin_dict(raw_margin_str):
 
 
 def safe_fine_roles_dict(value):
+    # JSON is what Home.py writes; literal_eval covers older rows stored as Python reprs
     try:
-        parsed = literal_eval(value)
-        return parsed if isinstance(parsed, dict) else {}
-    except:
-        return {}
+        parsed = json.loads(value)
+    except (TypeError, ValueError):
+        try:
+            parsed = literal_eval(value)
+        except:
+            return {}
+    return parsed if isinstance(parsed, dict) else {}
     
 #"{'Deceiver': 0.3147, 'Corrupt': 0.2053, 'Incompetent': 0.1512, 'Conspirator': 0.1025, 'Bigot': 0.0655}"
 def load_labels_old(folder_name, article_file_name, threshold=0.0):
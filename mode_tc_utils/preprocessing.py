@@ -42,6 +42,7 @@ def convert_prediction_txt_to_csv(article_id, article, prediction_file, article_
     """
     Converts a Stage 1 prediction .txt into a CSV with full article text.
     Adds the provided article_id to each row.
+    Returns the DataFrame that was written, so callers need not re-parse the CSV.
     """
     records = []
     with open(prediction_file, encoding="utf-8") as f:
@@ -70,4 +71,5 @@ def convert_prediction_txt_to_csv(article_id, article, prediction_file, article_
 
     df = pd.DataFrame(records)
     df.to_csv(output_csv, index=False, encoding="utf-8")
+    return df
 
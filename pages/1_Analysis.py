@@ -1,9 +1,8 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-import re
 from sidebar import render_sidebar, ROLE_COLORS, load_file_names, load_article, load_labels_stage2
-from render_text import reformat_text_html_with_tooltips, predict_entity_framing, format_sentence_with_spans, row_per_role_entity_framing
+from render_text import reformat_text_html_with_tooltips, predict_entity_framing, format_sentence_with_spans, row_per_role_entity_framing, index_mentions_by_sentence
 from streamlit.components.v1 import html as st_html
 import streamlit as st
 import os
@@ -14,9 +13,6 @@ import os
     #model = ChatOpenAI(temperature=0.7, api_key=openai_api_key)
     #st.info(model.invoke(input_text))
 
-def escape_entity(entity):
-    return re.sub(r'([.^$*+?{}\[\]\\|()])', r'\\\1', entity)
-
 def filter_labels_by_role(df_f, role_filter):
     """
     Filters rows of the DataFrame by main_role values in role_filter.
@@ -39,6 +35,74 @@ def filter_labels_by_role(df_f, role_filter):
 
 
 
+# --- Chart specs (cached on the plotted data, so reruns reuse the Vega-Lite JSON) ---
+
+def _vega_spec(chart):
+    """Serialize like st.altair_chart does: without Altair's default theme and without the 5000-row limit."""
+    with alt.themes.enable("none"), alt.data_transformers.disable_max_rows():
+        return chart.to_dict()
+
+
+@st.cache_data(show_spinner=False)
+def build_role_chart(grouped, color_list, domain_list):
+    # Bar chart
+    bars = alt.Chart(grouped).mark_bar(stroke='black', strokeWidth=0.5).encode(
+        x=alt.X('main_role:N', title='Main Role'),
+        y=alt.Y('count:Q', stack='zero'),
+        color=alt.Color('main_role:N', scale=alt.Scale(domain=domain_list, range=color_list), legend=None),
+        tooltip=['main_role', 'fine_roles', 'count']
+    )
+
+    label_chart = alt.Chart(grouped).mark_text(
+        color='black',
+        fontSize=11
+    ).encode(
+        x='main_role:N',
+        y=alt.Y('entities:Q'),
+        text='fine_roles:N'
+    )
+
+    # Combine
+    chart = (bars + label_chart).properties(
+        width=500,
+        title='Main Roles with Fine-Grained Role Segments'
+    )
+    return _vega_spec(chart)
+
+
+@st.cache_data(show_spinner=False)
+def build_timeline_chart(df_f):
+    timeline = alt.Chart(df_f).mark_bar().encode(
+        x=alt.X('start:Q', title='Position'), x2='end:Q',
+        y=alt.Y('entity:N', title='Entity'),
+        color=alt.Color('main_role:N', scale=alt.Scale(domain=list(ROLE_COLORS.keys()), range=list(ROLE_COLORS.values()))),
+        tooltip=['entity','main_role', 'confidence']
+    ).properties(height=200)
+    return _vega_spec(timeline)
+
+
+@st.cache_data(show_spinner=False)
+def build_pie_chart(role_counts):
+    pie = alt.Chart(role_counts).mark_arc(innerRadius=50).encode(
+        theta=alt.Theta(field='count', type='quantitative'),
+        color=alt.Color(field='main_role', type='nominal', scale=alt.Scale(domain=list(ROLE_COLORS.keys()), range=list(ROLE_COLORS.values()))),
+        tooltip=['main_role', 'count']
+    ).properties(title="Main Role Distribution")
+    return _vega_spec(pie)
+
+
+@st.cache_data(show_spinner=False)
+def build_confidence_histogram(df_roles):
+    chart = alt.Chart(df_roles).mark_bar().encode(
+        alt.X("confidence:Q", bin=alt.Bin(maxbins=20), title="Confidence"),
+        alt.Y("count()", title="Frequency"),
+        tooltip=['count()']
+    ).properties(
+        width=50,
+        height=400
+    ).interactive()
+    return _vega_spec(chart)
+
 
 # --- Streamlit App ---
 
@@ -80,15 +144,18 @@ st.text_area("Article", article, height=300)
 
 if article and labels:
     show_annot = st.checkbox("Show annotated article view", True)
-    df_f = []
-    df_f = predict_entity_framing(labels, threshold)
+    # Framing table and role-filtered labels are shared by every rendering loop below
+    framing_df = predict_entity_framing(labels, threshold)
+    df_f = framing_df
     ##st.write(df_f)
+    filtered_labels = filter_labels_by_role(framing_df, role_filter)
+    sent_to_mentions = index_mentions_by_sentence(filtered_labels)
 
     # 2. Annotated article view
     if show_annot:
         st.header("2. Annotated Article")
         ##st.write(filter_labels_by_role(df_f, role_filter))
-        html = reformat_text_html_with_tooltips(article, filter_labels_by_role(df_f, role_filter), hide_repeat)
+        html = reformat_text_html_with_tooltips(article, filtered_labels, hide_repeat)
         st.components.v1.html(html, height=600, scrolling = True)     
         
     # 3. Entity framing & timeline
@@ -115,59 +182,26 @@ if article and labels:
         grouped['prevsum'] = grouped['cumsum'] - grouped['count']
         grouped['entities'] = grouped['prevsum'] + grouped['count'] / 2
 
-        # Bar chart
-        bars = alt.Chart(grouped).mark_bar(stroke='black', strokeWidth=0.5).encode(
-            x=alt.X('main_role:N', title='Main Role'),
-            y=alt.Y('count:Q', stack='zero'),
-            color=alt.Color('main_role:N', scale=alt.Scale(domain=domain_list, range=color_list), legend=None),
-            tooltip=['main_role', 'fine_roles', 'count']
-        )
-
-        label_chart = alt.Chart(grouped).mark_text(
-            color='black',
-            fontSize=11
-        ).encode(
-            x='main_role:N',
-            y=alt.Y('entities:Q'),
-            text='fine_roles:N'
-        )
-
-        # Combine
-        chart = (bars + label_chart).properties(
-            width=500,
-            title='Main Roles with Fine-Grained Role Segments'
-        )
-
-        st.altair_chart(chart, use_container_width=True)
+        st.vega_lite_chart(build_role_chart(grouped, color_list, domain_list), use_container_width=True)
 
 
         ##st.write(df_f)
 
         #timeline
-        timeline = alt.Chart(df_f).mark_bar().encode(
-            x=alt.X('start:Q', title='Position'), x2='end:Q',
-            y=alt.Y('entity:N', title='Entity'),
-            color=alt.Color('main_role:N', scale=alt.Scale(domain=list(ROLE_COLORS.keys()), range=list(ROLE_COLORS.values()))),
-            tooltip=['entity','main_role', 'confidence']
-        ).properties(height=200)
-        st.altair_chart(timeline, use_container_width=True)
+        st.vega_lite_chart(build_timeline_chart(df_f), use_container_width=True)
 
         role_counts = df_f['main_role'].value_counts().reset_index()
         role_counts.columns = ['main_role', 'count']
 
         #pie chart
-        pie = alt.Chart(role_counts).mark_arc(innerRadius=50).encode(
-            theta=alt.Theta(field='count', type='quantitative'),
-            color=alt.Color(field='main_role', type='nominal', scale=alt.Scale(domain=list(ROLE_COLORS.keys()), range=list(ROLE_COLORS.values()))),
-            tooltip=['main_role', 'count']
-        ).properties(title="Main Role Distribution")
-
-        st.altair_chart(pie, use_container_width=True)
+        st.vega_lite_chart(build_pie_chart(role_counts), use_container_width=True)
 
     # --- Sentence Display by Role with Adaptive Layout ---
     st.markdown("## 4. Sentences by Role Classification")
 
-    df_f = df_f[df_f['main_role'].isin(ROLE_COLORS)]
+    # The sentence loops used to rebind df_f to the framing table on every iteration; doing it once
+    # here preserves that (the role columns and the histogram below read the framing table)
+    df_f = framing_df
 
     main_roles = ['Antagonist', 'Innocent','Protagonist']  # fixed order
     role_cols = st.columns(3)  # always 3 columns
@@ -185,9 +219,9 @@ if article and labels:
             )
             seen_fine_roles = None
             for sent in role_df['sentence'].unique():
-                df_f = predict_entity_framing(labels, threshold)
                 html_block, seen_fine_roles = format_sentence_with_spans(
-                    sent, filter_labels_by_role(df_f, role_filter), threshold, hide_repeat, False, seen_fine_roles
+                    sent, filtered_labels, threshold, hide_repeat, False, seen_fine_roles,
+                    sentence_mentions=sent_to_mentions.get(sent.strip(), [])
                 )
                 st.markdown(html_block, unsafe_allow_html=True)
 
@@ -206,9 +240,9 @@ if article and labels:
                     st.markdown(f"**{selected_fine}** — {len(fine_sents)} sentence(s):")
                     seen_fine_roles = None
                     for s in fine_sents:
-                        df_f = predict_entity_framing(labels, threshold)
                         html_block, seen_fine_roles = format_sentence_with_spans(
-                            s, filter_labels_by_role(df_f, role_filter), threshold, hide_repeat, True, seen_fine_roles
+                            s, filtered_labels, threshold, hide_repeat, True, seen_fine_roles,
+                            sentence_mentions=sent_to_mentions.get(s.strip(), [])
                         )
                         st_html(html_block, height=150, scrolling=True)
             elif fine_roles:
@@ -226,16 +260,7 @@ if article and labels:
         )
 
         # Create the chart
-        chart = alt.Chart(df_roles).mark_bar().encode(
-            alt.X("confidence:Q", bin=alt.Bin(maxbins=20), title="Confidence"),
-            alt.Y("count()", title="Frequency"),
-            tooltip=['count()']
-        ).properties(
-            width=50,
-            height=400
-        ).interactive()
-
-        st.altair_chart(chart, use_container_width=True)
+        st.vega_lite_chart(build_confidence_histogram(df_roles), use_container_width=True)
     else:
         st.info("No confidence data to display. Please select at least one role in the sidebar.")
 
@@ -296,75 +296,87 @@ def row_per_role_entity_framing(labels, threshold: float = 0.0):
 
 
 
-def format_sentence_with_spans(sentence_text, labels, threshold, hide_repeat=True, show_fine_roles=False, seen_fine_roles=None):
+def index_mentions_by_sentence(labels):
+    """Bucket (entity, mention) pairs by their stripped sentence text, keeping label order."""
+    sent_to_mentions = defaultdict(list)
+    for entity, mentions in labels.items():
+        for mention in mentions:
+            sent_to_mentions[mention.get('sentence', '').strip()].append((entity, mention))
+    return sent_to_mentions
+
+
+def format_sentence_with_spans(sentence_text, labels, threshold, hide_repeat=True, show_fine_roles=False, seen_fine_roles=None, sentence_mentions=None):
+    """Render one sentence with its entity spans highlighted.
+
+    Pass `sentence_mentions` (from `index_mentions_by_sentence`) to skip scanning all of `labels`.
+    """
     if seen_fine_roles is None:
         seen_fine_roles = defaultdict(set)
+    if sentence_mentions is None:
+        sentence_mentions = index_mentions_by_sentence(labels).get(sentence_text.strip(), [])
 
     spans = []
     sentence_lower = sentence_text.lower()
 
     ##st.write(labels)
 
-    for entity, mentions in labels.items():
+    for entity, mention in sentence_mentions:
         entity_key = entity.strip().lower()
 
-        for mention in mentions:
-            ##st.write(next(iter(mention.get('fine_roles', {}).values()), None))
-            if next(iter(mention.get('fine_roles', {}).values()), None) < threshold:
-                continue
-            if mention.get('sentence', '').strip() != sentence_text.strip():
-                continue
-            ##st.write("2")
-
-            mention_text = entity.strip()
-            if not mention_text:
-                continue
-            ##st.write("3")
-
-            match_start = sentence_lower.find(mention_text.lower())
-            if match_start == -1:
-                continue
-            match_end = match_start + len(mention_text)
-            ##st.write("4")
-
-            main_role = mention.get('main_role', '')
-            base_color = ROLE_COLORS.get(main_role, "#000000")
-            ##st.write("5")
-
-            fine_roles_raw = mention.get('fine_roles', [])
-            fine_roles_set = frozenset(r.strip().title() for r in fine_roles_raw)
-            fine_roles_str = ", ".join(fine_roles_set)
+        ##st.write(next(iter(mention.get('fine_roles', {}).values()), None))
+        if next(iter(mention.get('fine_roles', {}).values()), None) < threshold:
+            continue
+        ##st.write("2")
 
-            ##st.write(f"mention:{mention}, start:{match_start}, main_role:{main_role}, fine_roles_str:{fine_roles_str}")
+        mention_text = entity.strip()
+        if not mention_text:
+            continue
+        ##st.write("3")
 
-            is_repeated = fine_roles_set in seen_fine_roles[entity_key]
-            seen_fine_roles[entity_key].add(fine_roles_set)
+        match_start = sentence_lower.find(mention_text.lower())
+        if match_start == -1:
+            continue
+        match_end = match_start + len(mention_text)
+        ##st.write("4")
 
-            if hide_repeat and is_repeated and base_color.startswith("#") and len(base_color) == 7:
-                r = int(base_color[1:3], 16)
-                g = int(base_color[3:5], 16)
-                b = int(base_color[5:7], 16)
-                background_color = f"rgba({r}, {g}, {b}, 0.3)"
-            else:
-                background_color = base_color
+        main_role = mention.get('main_role', '')
+        base_color = ROLE_COLORS.get(main_role, "#000000")
+        ##st.write("5")
 
-            mention_display = html_utils.escape(sentence_text[match_start:match_end])
+        fine_roles_raw = mention.get('fine_roles', [])
+        fine_roles_set = frozenset(r.strip().title() for r in fine_roles_raw)
+        fine_roles_str = ", ".join(fine_roles_set)
 
-            if show_fine_roles:
-                fine_roles_html = f' | <span style="font-size:smaller; opacity:0.75;">{fine_roles_str}</span>'
-            else:
-                fine_roles_html = ""
+        ##st.write(f"mention:{mention}, start:{match_start}, main_role:{main_role}, fine_roles_str:{fine_roles_str}")
 
-            span_html = (
-                f'<span style="background-color:{background_color}; padding:3px 6px; border-radius:4px;">'
-                f'{mention_display}{fine_roles_html}</span>'
-            )
+        is_repeated = fine_roles_set in seen_fine_roles[entity_key]
+        seen_fine_roles[entity_key].add(fine_roles_set)
+
+        if hide_repeat and is_repeated and base_color.startswith("#") and len(base_color) == 7:
+            r = int(base_color[1:3], 16)
+            g = int(base_color[3:5], 16)
+            b = int(base_color[5:7], 16)
+            background_color = f"rgba({r}, {g}, {b}, 0.3)"
+        else:
+            background_color = base_color
 
-            spans.append({
-                "start": match_start,
-                "end": match_end,
-                "html": span_html
-            })
+        mention_display = html_utils.escape(sentence_text[match_start:match_end])
+
+        if show_fine_roles:
+            fine_roles_html = f' | <span style="font-size:smaller; opacity:0.75;">{fine_roles_str}</span>'
+        else:
+            fine_roles_html = ""
+
+        span_html = (
+            f'<span style="background-color:{background_color}; padding:3px 6px; border-radius:4px;">'
+            f'{mention_display}{fine_roles_html}</span>'
+        )
+
+        spans.append({
+            "start": match_start,
+            "end": match_end,
+            "html": span_html
+        })
 
     # Merge spans
     spans.sort(key=lambda x: x["start"])
@@ -9,6 +9,14 @@ import torch
 from pathlib import Path
 import unicodedata
 
+def _context_length(config, default: int = 1024) -> int:
+    """Window length for `config`: DeBERTa's relative positions allow `default`, absolute-position
+    backbones (e.g. a distilled student) are capped at their `max_position_embeddings`."""
+    if not getattr(config, "position_biased_input", True):
+        return default
+    return min(default, getattr(config, "max_position_embeddings", default))
+
+
 class DebertaV3NerClassifier(BertNerClassifier):
     """DeBERTa v3-based token-classification model for NER."""
 
@@ -82,7 +90,7 @@ class DebertaV3NerClassifier(BertNerClassifier):
             inst.id2label = config.id2label
             inst.label2id = config.label2id
             inst.model_checkpoint = path
-            inst.max_length = 1024
+            inst.max_length = _context_length(config)
             inst.doc_stride = 256
             
             # Load tokenizer and model directly from HF Hub
@@ -127,8 +135,7 @@ class DebertaV3NerClassifier(BertNerClassifier):
             inst.id2label = {int(k): v for k, v in params["id2label"].items()}
             inst.label2id = params["label2id"]
             inst.model_checkpoint = params["model_checkpoint"]
-            # reasonable defaults (same as __init__ fallback for DeBERTa)
-            inst.max_length = 1024
+            # reasonable default (same as __init__ fallback); max_length is set from the config below
             inst.doc_stride = 256
 
             # ------------------------------
@@ -173,6 +180,7 @@ class DebertaV3NerClassifier(BertNerClassifier):
                 id2label=inst.id2label,
                 label2id=inst.label2id,
             )
+            inst.max_length = _context_length(config)
 
             # ------------------------------------------------------------------
             # Initialise backbone WITHOUT passing the state_dict to avoid the
@@ -223,7 +231,8 @@ class DebertaV3NerClassifier(BertNerClassifier):
             inputs = {k: v[i].unsqueeze(0).to(device) for k, v in encodings.items() if k in ["input_ids", "attention_mask"]}
             with torch.no_grad():
                 # Get raw emissions (logits) without softmax
-                emissions = self.model(**inputs, return_dict=True).logits  # Raw emissions (1, L, C)
+                # Upcast so half-precision backbones still give FP32 emissions/probabilities
+                emissions = self.model(**inputs, return_dict=True).logits.float()  # Raw emissions (1, L, C)
 
             # Decode with CRF if present, using raw emissions
             if hasattr(self.model, "crf") and self.model.crf is not None:
@@ -0,0 +1,39 @@
+"""Model ids, the quantized-export cache layout and load-time tweaks shared by
+Home.py and export_and_quantize.py."""
+
+import os
+from pathlib import Path
+
+NER_MODEL_PATH = 'artur-muratov/franx-ner'
+# Distilled student of the NER model, served instead of it when FRANX_FAST=1
+NER_FAST_MODEL_PATH = 'artur-muratov/franx-ner-distil'
+CLS_MODEL_PATH = "artur-muratov/franx-cls"
+
+CACHE_DIR = Path.home() / ".cache" / "franx"
+QUANTIZED_FILE = "model_quantized.onnx"
+
+
+def ner_model_path():
+    """Return the NER model to serve: the distilled student when FRANX_FAST=1, else the teacher."""
+    return NER_FAST_MODEL_PATH if os.environ.get('FRANX_FAST') == '1' else NER_MODEL_PATH
+
+
+def quantized_dir(model_path):
+    """Return the cache directory holding the quantized export of `model_path`."""
+    return CACHE_DIR / (model_path.replace('/', '__') + "-onnx-int8")
+
+
+def has_quantized_export(model_path):
+    return (quantized_dir(model_path) / QUANTIZED_FILE).is_file()
+
+
+def add_non_o_bias(bert_model, value=1.0):
+    """Add `value` to the classifier bias of every non-O class (same as inference_deberta)."""
+    import torch
+
+    with torch.no_grad():
+        current_bias = bert_model.model.classifier.bias
+        o_index = bert_model.label2id.get('O', 0)
+        for i in range(len(current_bias)):
+            if i != o_index:
+                current_bias[i] += value